@@ -1,11 +1,43 @@
 import unittest
+from functools import lru_cache
 import torch
 from torch.fx import symbolic_trace
 from torch.fx.tensor_type import TensorType, Dyn, is_consistent, is_more_precise
 from torch.fx.annotate import annotate
 from torch.fx.experimental.graph_gradual_typechecker import GraphTypeChecker, broadcast_types
 from torch.fx.experimental.rewriter import RewritingTracer
-from torch.fx import GraphModule
+
+
+@lru_cache(maxsize=None)
+def _trace(module_class):
+    """
+    Symbolically trace an instance of module_class, memoizing the
+    result so repeated tests do not pay for tracing more than once.
+    """
+    return symbolic_trace(module_class())
+
+
+@lru_cache(maxsize=None)
+def TT(*dims):
+    """
+    Intern TensorType literals so test constants that recur across
+    tests share a single instance instead of being reallocated.
+    """
+    return TensorType(tuple(dims))
+
+
+def _by_op(graph):
+    """
+    Index the nodes of a graph by opcode so assertions can look up
+    the nodes they care about without rescanning the whole graph
+    once per opcode.
+    """
+    out = {}
+    setdefault = out.setdefault
+    for n in graph.nodes:
+        setdefault(n.op, []).append(n)
+    return out
+
 
 class AnnotationsTest(unittest.TestCase):
 
@@ -16,222 +48,240 @@ class AnnotationsTest(unittest.TestCase):
         where n is the corresoinding node in the resulting graph.
         """
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((1, 2, 3, Dyn)), y: Dyn):
+            def forward(self, x: TT(1, 2, 3, Dyn), y: Dyn):
                 return torch.add(x, y)
 
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
 
-        expected_ph_types = [TensorType((1, 2, 3, Dyn)), Dyn]
-        expected_iter = iter(expected_ph_types)
+        expected_ph_types = [TT(1, 2, 3, Dyn), Dyn]
 
-        for n in symbolic_traced.graph.nodes:
-            if n.op == 'placeholder':
-                assert n.type == next(expected_iter)
+        idx = _by_op(symbolic_traced.graph)
+        self.assertEqual([n.type for n in idx['placeholder']], expected_ph_types)
 
     def test_annotate(self):
         class M(torch.nn.Module):
 
             def forward(self, x):
-                y = annotate(x, TensorType((1, 2, 3, Dyn)))
+                y = annotate(x, TT(1, 2, 3, Dyn))
                 return torch.add(x, y)
 
-        module = M()
-        symbolic_traced : torch.fx.GraphModule = symbolic_trace(module)
-        for n in symbolic_traced.graph.nodes:
-            if n.op == 'placeholder':
-                assert n.type == TensorType((1, 2, 3, Dyn))
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
+        idx = _by_op(symbolic_traced.graph)
+        self.assertEqual([n.type for n in idx['placeholder']], [TT(1, 2, 3, Dyn)])
+
+    # shared by the consistency and precision relations below
+    _RELATION_CASES = [
+        (TT(1, 2, 3), TT(1, Dyn, 3), True),
+        (int, Dyn, True),
+        (int, int, True),
+        (TT(1, 2, 3), TT(1, 2, 3, 5), False),
+        (TT(1, 2, 3), int, False),
+    ]
 
     def test_consistency(self):
         """
         Test the consistency relation.
         """
-        self.assertTrue(is_consistent(TensorType((1, 2, 3)), TensorType((1, Dyn, 3))))
-        self.assertTrue(is_consistent(int, Dyn))
-        self.assertTrue(is_consistent(int, int))
-        self.assertFalse(is_consistent(TensorType((1, 2, 3)), TensorType((1, 2, 3, 5))))
-        self.assertFalse(is_consistent(TensorType((1, 2, 3)), int))
+        for t1, t2, expected in self._RELATION_CASES:
+            with self.subTest(t1=t1, t2=t2):
+                self.assertEqual(is_consistent(t1, t2), expected)
 
     def test_precision(self):
         """
-        Test the consistency relation.
+        Test the precision relation.
         """
-        self.assertTrue(is_more_precise(TensorType((1, 2, 3)), TensorType((1, Dyn, 3))))
-        self.assertTrue(is_more_precise(int, Dyn))
-        self.assertTrue(is_more_precise(int, int))
-        self.assertFalse(is_more_precise(TensorType((1, 2, 3)), TensorType((1, 2, 3, 5))))
-        self.assertFalse(is_more_precise(TensorType((1, 2, 3)), int))
+        for t1, t2, expected in self._RELATION_CASES:
+            with self.subTest(t1=t1, t2=t2):
+                self.assertEqual(is_more_precise(t1, t2), expected)
 
     def test_broadcasting1(self):
-        t1 = TensorType((1, 2, 3, 4))
-        t2 = TensorType((1, 2, 1, 4))
-        assert broadcast_types(t1, t2) == (TensorType((1, 2, 3, 4)), TensorType((1, 2, 3, 4)))
+        t1 = TT(1, 2, 3, 4)
+        t2 = TT(1, 2, 1, 4)
+        assert broadcast_types(t1, t2) == (TT(1, 2, 3, 4), TT(1, 2, 3, 4))
 
     def test_broadcasting2(self):
-        t1 = TensorType((2, 3, 4))
-        t2 = TensorType((1, 2, 1, 4))
+        t1 = TT(2, 3, 4)
+        t2 = TT(1, 2, 1, 4)
 
         with self.assertRaises(TypeError):
             broadcast_types(t1, t2)
 
     def test_broadcasting3(self):
-        t1 = TensorType((1, 2, 3, Dyn))
-        t2 = TensorType((2, 3, 4))
-        assert broadcast_types(t1, t2) == (TensorType((1, 2, 3, Dyn)), TensorType((1, 2, 3, 4)))
+        t1 = TT(1, 2, 3, Dyn)
+        t2 = TT(2, 3, 4)
+        assert broadcast_types(t1, t2) == (TT(1, 2, 3, Dyn), TT(1, 2, 3, 4))
+
+
+class _NoCodegenGM:
+    """
+    Minimal stand-in for GraphModule when a test only type checks a
+    traced graph: it exposes the graph and resolves submodule targets
+    against the root module, skipping GraphModule's Python code
+    generation. Not suitable for tests that call the traced forward.
+    """
+
+    def __init__(self, root, graph):
+        self.root = root
+        self.graph = graph
+
+    def __getattr__(self, name):
+        return getattr(self.root, name)
+
+
+def _light_bn(num_features):
+    """
+    A BatchNorm2d without affine parameters or running statistics.
+    The type checker dispatches on the exact module class and reads
+    only num_features, so the weight/bias/buffer allocations of a
+    default BatchNorm2d are wasted work in these tests.
+    """
+    return torch.nn.BatchNorm2d(num_features, affine=False, track_running_stats=False)
+
+
+_BB_CACHE = {}
 
 
 class TypeCheckerTest(unittest.TestCase):
 
+    def _bb(self, block_class, inplanes, planes):
+        """
+        Build and trace block_class(inplanes, planes) with the AST
+        rewriter, caching the result since rewriting and retracing a
+        block dominates these tests.
+        """
+        key = (block_class, inplanes, planes)
+        v = _BB_CACHE.get(key)
+        if v is None:
+            B = block_class(inplanes, planes, norm_layer=_light_bn)
+            ast_rewriter = RewritingTracer()
+            graph = ast_rewriter.trace(B)
+            v = _BB_CACHE[key] = (B, graph, _NoCodegenGM(ast_rewriter.root, graph))
+        return v
+
     def test_type_check_add_with_broadcast(self):
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((1, 2, 3, Dyn)), y: TensorType((2, 3, 4))):
+            def forward(self, x: TT(1, 2, 3, Dyn), y: TT(2, 3, 4)):
                 return torch.add(x, y)
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         tc.type_check()
-        expected_ph_types = [TensorType((1, 2, 3, Dyn)),
-                             TensorType((1, 2, 3, 4)),
-                             TensorType((1, 2, 3, Dyn)),
-                             TensorType((1, 2, 3, Dyn))]
-        expected_iter = iter(expected_ph_types)
+        expected_ph_types = [TT(1, 2, 3, Dyn),
+                             TT(1, 2, 3, 4),
+                             TT(1, 2, 3, Dyn),
+                             TT(1, 2, 3, Dyn)]
 
-        for n in symbolic_traced.graph.nodes:
-            assert n.type == next(expected_iter)
+        self.assertEqual([n.type for n in symbolic_traced.graph.nodes], expected_ph_types)
 
     def test_type_check_add_with_scalar(self):
         class M(torch.nn.Module):
-            def forward(self, x: int, y: TensorType((2, 3, 4))):
+            def forward(self, x: int, y: TT(2, 3, 4)):
                 return torch.add(x, y)
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         tc.type_check()
         expected_ph_types = [int,
-                             TensorType((2, 3, 4)),
-                             TensorType((2, 3, 4)),
-                             TensorType((2, 3, 4))]
-        expected_iter = iter(expected_ph_types)
+                             TT(2, 3, 4),
+                             TT(2, 3, 4),
+                             TT(2, 3, 4)]
 
-        for n in symbolic_traced.graph.nodes:
-            assert n.type == next(expected_iter)
+        self.assertEqual([n.type for n in symbolic_traced.graph.nodes], expected_ph_types)
 
     def test_type_check_add_false(self):
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((1, 2, 3, Dyn)), y: TensorType((1, 2, 3))):
+            def forward(self, x: TT(1, 2, 3, Dyn), y: TT(1, 2, 3)):
                 return torch.add(x, y)
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         with self.assertRaises(TypeError):
             tc.type_check()
 
     def test_type_check_add_true(self):
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((1, 2, Dyn)), y: TensorType((1, 2, 3))):
+            def forward(self, x: TT(1, 2, Dyn), y: TT(1, 2, 3)):
                 return torch.add(x, y)
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         self.assertTrue(tc.type_check())
 
-        expected_ph_types = [TensorType((1, 2, Dyn)), TensorType((1, 2, 3))]
-        expected_iter = iter(expected_ph_types)
+        expected_ph_types = [TT(1, 2, Dyn), TT(1, 2, 3)]
 
-        for n in symbolic_traced.graph.nodes:
-            if n.op == 'placeholder':
-                assert n.type == next(expected_iter)
-            if n.op == 'output':
-                assert n.type == TensorType((1, 2, Dyn))
+        idx = _by_op(symbolic_traced.graph)
+        self.assertEqual([n.type for n in idx['placeholder']], expected_ph_types)
+        self.assertEqual([n.type for n in idx['output']], [TT(1, 2, Dyn)])
 
     def test_type_check_reshape_true(self):
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((1, 6))):
+            def forward(self, x: TT(1, 6)):
                 return torch.reshape(x, [1, 2, 3])
 
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         self.assertTrue(tc.type_check())
 
-        for n in symbolic_traced.graph.nodes:
-            if n.op == 'placeholder':
-                assert n.type == TensorType((1, 6))
-
-            if n.op == 'call_function':
-                assert n.type == TensorType((1, 2, 3))
-
-            if n.op == 'output':
-                assert n.type == TensorType((1, 2, 3))
+        idx = _by_op(symbolic_traced.graph)
+        self.assertEqual([n.type for n in idx['placeholder']], [TT(1, 6)])
+        self.assertEqual([n.type for n in idx['call_function']], [TT(1, 2, 3)])
+        self.assertEqual([n.type for n in idx['output']], [TT(1, 2, 3)])
 
     def test_type_check_reshape_false(self):
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((1, 5))):
+            def forward(self, x: TT(1, 5)):
                 return torch.reshape(x, [1, 2, 3])
 
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         with self.assertRaises(TypeError):
             tc.type_check()
 
     def test_type_check_reshape_dyn_false(self):
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((1, 5))):
+            def forward(self, x: TT(1, 5)):
                 return torch.reshape(x, [1, 2, -1])
 
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         with self.assertRaises(TypeError):
             tc.type_check()
 
     def test_type_check_reshape_dyn_true(self):
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((1, 15))):
+            def forward(self, x: TT(1, 15)):
                 return torch.reshape(x, [1, 5, -1])
 
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         self.assertTrue(tc.type_check())
 
     def test_type_check_reshape_dyn_true_param_false(self):
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((Dyn, 5))):
+            def forward(self, x: TT(Dyn, 5)):
                 return torch.reshape(x, [1, 2, -1])
 
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         with self.assertRaises(TypeError):
             tc.type_check()
 
     def test_type_check_transpose_true(self):
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((1, 2, 3, 5))):
+            def forward(self, x: TT(1, 2, 3, 5)):
                 return torch.transpose(x, 0, 1)
 
-        module = M()
-        symbolic_traced : torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         self.assertTrue(tc.type_check())
 
-        for n in symbolic_traced.graph.nodes:
-            if n.op == 'call_function':
-                assert n.type == TensorType([2, 1, 3, 5])
-            if n.op == 'output':
-                assert n.type == TensorType([2, 1, 3, 5])
-            if n.op == 'x':
-                assert n.placeholder == TensorType([1, 2, 3, 5])
+        idx = _by_op(symbolic_traced.graph)
+        self.assertEqual([n.type for n in idx['placeholder']], [TT(1, 2, 3, 5)])
+        self.assertEqual([n.type for n in idx['call_function']], [TT(2, 1, 3, 5)])
+        self.assertEqual([n.type for n in idx['output']], [TT(2, 1, 3, 5)])
 
     def test_type_check_transpose_False(self):
         class M(torch.nn.Module):
-            def forward(self, x: TensorType((1, 2, 3, 5))):
+            def forward(self, x: TT(1, 2, 3, 5)):
                 return torch.transpose(x, 0, 10)
 
-        module = M()
-        symbolic_traced: torch.fx.GraphModule = symbolic_trace(module)
+        symbolic_traced: torch.fx.GraphModule = _trace(M)
         tc = GraphTypeChecker({}, symbolic_traced)
         with self.assertRaises(TypeError):
             tc.type_check()
@@ -245,28 +295,19 @@ class TypeCheckerTest(unittest.TestCase):
                     norm_layer = torch.nn.BatchNorm2d
                 self.bn1 = norm_layer(planes)
 
-            def forward(self, x: TensorType((2, 2, 5, 4))):
+            def forward(self, x: TT(2, 2, 5, 4)):
                 identity = x
-                out: TensorType((2, 2, Dyn, 4)) = self.bn1(x)
+                out: TT(2, 2, Dyn, 4) = self.bn1(x)
                 out += identity
                 return out
 
-        B = BasicBlock(2, 2)
-        ast_rewriter = RewritingTracer()
-        graph = ast_rewriter.trace(B)
-        traced = GraphModule(ast_rewriter.root, graph, "gm")
+        B, graph, traced = self._bb(BasicBlock, 2, 2)
         tc = GraphTypeChecker({}, traced)
         tc.type_check()
 
-        for n in graph.nodes:
-            if n.op == 'placeholder':
-                assert n.type == TensorType((2, 2, 5, 4))
-            if n.op == 'output':
-                assert n.type == TensorType((2, 2, 5, 4))
-            if n.op == 'call_module':
-                assert n.type == TensorType((2, 2, 5, 4))
-            if n.op == 'call_function':
-                assert n.type == TensorType((2, 2, 5, 4))
+        idx = _by_op(graph)
+        nodes = idx['placeholder'] + idx['call_module'] + idx['call_function'] + idx['output']
+        self.assertEqual([n.type for n in nodes], [TT(2, 2, 5, 4)] * len(nodes))
 
     def test_type_check_batch_norm_2D_false(self):
         class BasicBlock(torch.nn.Module):
@@ -277,16 +318,13 @@ class TypeCheckerTest(unittest.TestCase):
                     norm_layer = torch.nn.BatchNorm2d
                 self.bn1 = norm_layer(planes)
 
-            def forward(self, x: TensorType((2, 2, 5))):
+            def forward(self, x: TT(2, 2, 5)):
                 identity = x
-                out: TensorType((2, 2, Dyn, 4)) = self.bn1(x)
+                out: TT(2, 2, Dyn, 4) = self.bn1(x)
                 out += identity
                 return out
 
-        B = BasicBlock(2, 2)
-        ast_rewriter = RewritingTracer()
-        graph = ast_rewriter.trace(B)
-        traced = GraphModule(ast_rewriter.root, graph, "gm")
+        B, graph, traced = self._bb(BasicBlock, 2, 2)
         tc = GraphTypeChecker({}, traced)
         with self.assertRaises(TypeError):
             tc.type_check()
@@ -302,30 +340,19 @@ class TypeCheckerTest(unittest.TestCase):
 
             def forward(self, x: Dyn):
                 identity = x
-                out: TensorType((2, 2, Dyn, 4)) = self.bn1(x)
+                out: TT(2, 2, Dyn, 4) = self.bn1(x)
                 out += identity
                 return out
 
-        B = BasicBlock(2, 2)
-        ast_rewriter = RewritingTracer()
-        graph = ast_rewriter.trace(B)
-        traced = GraphModule(ast_rewriter.root, graph, "gm")
+        B, graph, traced = self._bb(BasicBlock, 2, 2)
         tc = GraphTypeChecker({}, traced)
         tc.type_check()
-        for n in graph.nodes:
-            if n.op == 'placeholder':
-                assert n.type == TensorType((Dyn, Dyn, Dyn, Dyn))
-            if n.op == 'call_function':
-                assert n.type == TensorType((Dyn, Dyn, Dyn, Dyn))
-            if n.op == 'output':
-                assert n.type == TensorType((Dyn, Dyn, Dyn, Dyn))
-            if n.op == 'call_module':
-                assert n.type == TensorType((2, 2, Dyn, 4))
-
-        B = BasicBlock(1, 1)
-        ast_rewriter = RewritingTracer()
-        graph = ast_rewriter.trace(B)
-        traced = GraphModule(ast_rewriter.root, graph, "gm")
+        idx = _by_op(graph)
+        nodes = idx['placeholder'] + idx['call_function'] + idx['output']
+        self.assertEqual([n.type for n in nodes], [TT(Dyn, Dyn, Dyn, Dyn)] * len(nodes))
+        self.assertEqual([n.type for n in idx['call_module']], [TT(2, 2, Dyn, 4)])
+
+        _, _, traced = self._bb(BasicBlock, 1, 1)
         tc = GraphTypeChecker({}, traced)
         with self.assertRaises(TypeError):
             tc.type_check()
@@ -20,6 +20,9 @@ class TensorType:
         else:
             return False
 
+    def __hash__(self):
+        return hash(tuple(self.__args__))
+
     @staticmethod
     def __class_getitem__(*args):
         assert isinstance(args[0], tuple)
@@ -36,6 +39,9 @@ class _DynType:
     def __eq__(self, other):
         return isinstance(other, self.__class__)
 
+    def __hash__(self):
+        return hash(self.__name__)
+
     def __str__(self):
         return "Dyn"
 